@@ -1,19 +1,31 @@
-import pandas as pd
+import csv
+import logging
 import os
+from openpyxl import Workbook
+
+logger = logging.getLogger(__name__)
 
 
 def csv_to_xlsx(filename):
     try:
-        df = pd.read_csv(filename)
         file_directory = os.path.dirname(os.path.abspath(filename))
         file_name, _ = os.path.splitext(os.path.basename(filename))
         xlsx_filename = os.path.join(file_directory, f'{file_name}.xlsx')
-        df.to_excel(xlsx_filename, index=False)
 
-        print(f"Conversion successful. Excel file saved at: {xlsx_filename}")
+        # write-only mode streams rows to disk instead of keeping every cell in memory
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet('Sheet1')
+        with open(filename, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                # cells keep the CSV text as-is, so ids and zip codes keep their leading zeros
+                ws.append([value if value else None for value in row])
+        wb.save(xlsx_filename)
+
+        logger.info(f"Conversion successful. Excel file saved at: {xlsx_filename}")
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error(f"Error: {e}")
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     csv_to_xlsx("data/ARMASTER11-21-23.csv")
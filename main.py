@@ -1,9 +1,22 @@
 import pandas as pd
 import asyncio
-from bs4 import BeautifulSoup
-from io import StringIO
+import csv
 import logging
+import os
+import random
+from urllib.parse import quote_plus
 import aiohttp
+from lxml import etree
+
+try:
+    import uvloop
+except ImportError:  # uvloop does not support Windows
+    uvloop = None
+
+DEFAULT_HEADERS = {
+    'Origin': 'https://registry.faa.gov',
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36',
+}
 
 
 class Scraper:
@@ -13,13 +26,19 @@ class Scraper:
        Args:
        - input_file (str): Path to the CSV file containing the list of aircraft N-NUMBERs.
        - output_file (str, optional): Path to the output CSV file. If not provided, the input file will be overwritten.
-       - timeout (float, optional): Timeout duration for HTTP requests, in seconds.
+       - timeout (float, optional): Read timeout for HTTP requests, in seconds (20 if not given).
+         Each request's total deadline is the larger of 30s and the read timeout plus 10s.
 
        Attributes:
        - URL (str): The URL for fetching aircraft information from the FAA registry.
        - columns (list): List of column names representing the information to be extracted.
        - logger (Logger): Logger instance for recording events during scraping.
-       - timeout (float): Timeout duration for HTTP requests, in seconds.
+       - timeout (float): Read timeout for HTTP requests, in seconds.
+       - concurrency (int): Maximum number of requests in flight at once.
+       - retries (int): Number of attempts made for each request before the record is skipped.
+       - failed (list): N-NUMBERs that could not be fetched during the last run.
+       - part_file (str): Path of the append-only file that scraped records are checkpointed to
+         until they are merged into the output file.
     """
     URL = 'https://registry.faa.gov/aircraftinquiry/Search/NNumberResult'
 
@@ -29,12 +48,30 @@ class Scraper:
             self.output_file = input_file
         else:
             self.output_file = output_file
+        self.part_file = self.output_file + '.part'
         self.columns = [
             'STATUS', 'MANUFACTURER NAME', 'MODEL', 'TYPE AIRCRAFT',
             'TYPE ENGINE', 'PENDING NUMBER CHANGE', 'DATE CHANGE AUTHORIZED',
             'TYPE REGISTRATION', 'COUNTY', 'ENGINE MANUFACTURER', 'ENGINE MODEL'
         ]
         self.timeout = timeout
+        self.concurrency = 20
+        self.retries = 3
+        self.failed = []
+        # the search form only ever carries NNumbertxt, so its body is encoded by hand
+        self._headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        # pull parsers are reused between requests, at most one per request in flight
+        self._parsers = []
+        # compiled once; applied to every <table> the pull parser finishes
+        self._is_devkit_table = etree.XPath("contains(concat(' ', normalize-space(@class), ' '), ' devkit-table ')")
+        # one expression selecting just the label cells of the wanted columns, generated from
+        # self.columns so a record never walks the rows it has no use for
+        # labels are compared case-insensitively, as the page's capitalization is not guaranteed
+        self._labels = {column.lower(): column for column in self.columns}
+        lowered = "translate(normalize-space(), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')"
+        self._label_cells = etree.XPath(
+            './/tr/td[{}]'.format(' or '.join(f'{lowered}="{label}"' for label in self._labels))
+        )
         self.logger = self.setup_logger()
 
     def setup_logger(self):
@@ -49,34 +86,82 @@ class Scraper:
     async def fetch_html(self, session, form_data):
         """
             Asynchronously fetch HTML content for a given N-NUMBER using aiohttp.
+            The response body is fed to an incremental lxml parser as it arrives,
+            and parsing stops once the last table of interest has been seen.
 
             Args:
                 session (aiohttp.ClientSession): The aiohttp session for making asynchronous HTTP requests.
                 form_data (str): The N-NUMBER(unique ID) for which HTML content is to be fetched.
 
             Returns:
-                str or None: The HTML content if successful, None if an error occurs.
+                list or None: The parsed devkit-table elements if successful, None if an error occurs.
+        """
+        body = b'NNumbertxt=' + quote_plus(str(form_data)).encode()
+        for attempt in range(1, self.retries + 1):
+            try:
+                async with session.post(self.URL, data=body, headers=self._headers) as response:
+                    response.raise_for_status()
+                    parser = self._parsers.pop() if self._parsers else self.create_parser()
+                    try:
+                        tables = []
+                        async for chunk in response.content.iter_chunked(16384):
+                            # process_record never looks past the third table; the rest of the
+                            # body is still drained so the connection can go back to the pool
+                            if len(tables) >= 3:
+                                continue
+                            parser.feed(chunk)
+                            for _, element in parser.read_events():
+                                if self._is_devkit_table(element):
+                                    tables.append(element)
+                        return tables
+                    finally:
+                        self.release_parser(parser)
+            except (aiohttp.ClientError, aiohttp.http.HttpProcessingError, asyncio.TimeoutError) as e:
+                # transient resets, 5xx and 429 responses are expected over thousands of requests;
+                # any other error status will not change on a retry
+                transient = not isinstance(e, aiohttp.ClientResponseError) or e.status >= 500 or e.status == 429
+                if not transient or attempt == self.retries:
+                    self.logger.error(f"aiohttp error: {type(e).__name__}: {e}")
+                    break
+                await asyncio.sleep(0.25 * 2 ** (attempt - 1) + random.random() * 0.1)
+            except Exception as e:
+                self.logger.error(f"Error during HTTP request: {e}")
+                break
+        self.failed.append(form_data)
+        return None
+
+    def create_parser(self):
+        """
+            Create a pull parser that reports each finished <table> element.
+
+            Returns:
+                lxml.etree.HTMLPullParser: A new parser for the parser pool.
+        """
+        return etree.HTMLPullParser(events=('end',), tag='table', encoding='utf-8',
+                                    remove_blank_text=True, collect_ids=False)
+
+    def release_parser(self, parser):
+        """
+            Reset a pull parser and return it to the pool so the next request
+            can reuse it instead of allocating a new one.
+
+            Args:
+                parser (lxml.etree.HTMLPullParser): The parser used for a finished request.
         """
-        form_data = {'NNumbertxt': form_data}
-        headers = {
-            'Origin': 'https://registry.faa.gov',
-            'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36',
-        }
         try:
-            async with session.post(self.URL, data=form_data, headers=headers) as response:
-                return await response.text()
-        except (aiohttp.ClientError, aiohttp.http.HttpProcessingError) as e:
-            self.logger.error(f"aiohttp error: {e}")
-            return None
-        except Exception as e:
-            self.logger.error(f"Error during HTTP request: {e}")
-            return None
+            parser.close()
+        except etree.XMLSyntaxError:
+            pass  # nothing was fed to it
+        # drop events still queued from the previous document
+        for _ in parser.read_events():
+            pass
+        self._parsers.append(parser)
 
     async def process_record(self, session, id_value):
         """
             Asynchronously process HTML content to extract aircraft information.
-            Parses html tables with BeautifulSoup and processes to pandas DataFrames
-            using pandas `read_html()`
+            Looks up the label cell of each wanted column in the parsed tables
+            and reads the value from the cell next to it.
             Args:
                 session (aiohttp.ClientSession):
                 id_value (str): The N-NUMBER unique ID
@@ -85,46 +170,24 @@ class Scraper:
                 dict: A dictionary containing aircraft information.
 
         """
-        def process_dataframe(data):
-            try:
-                df1 = data.T[:2]
-                df1.columns = df1.loc[0]
-                df1.drop(0, inplace=True)
-                df1.reset_index(drop=True, inplace=True)
-
-                df2 = data.T[2:]
-                df2.columns = df2.loc[2]
-                df2.drop(2, inplace=True)
-                df2.reset_index(drop=True, inplace=True)
-                return [df1, df2]
-            except Exception as e:
-                self.logger.error(f"Error processing DataFrame: {e}")
-                return None
-
-        html = await self.fetch_html(session, id_value)
-        if html is None:
+        tables = await self.fetch_html(session, id_value)
+        if tables is None:
             self.logger.warning(f"Skipping record with N-NUMBER {id_value} due to HTTP request error.")
             return {}
 
-        soup = BeautifulSoup(html, 'html.parser')
-        html_tables = soup.select("table.devkit-table")
-        # passing str will be deprecated in future
-        html_buffer = StringIO(str(html_tables))
-        data = pd.read_html(html_buffer)
-        data_dict = dict()
-        df_list = []
-
-        count = 1 if len(data) <= 2 else 3
+        data_dict = dict.fromkeys(self.columns, "N/A")
 
-        for i in range(count):
-            df = process_dataframe(data[i])
-            if df is not None:
-                df_list += df
+        count = 1 if len(tables) <= 2 else 3
 
-        for df in df_list:
-            data_dict.update(df.loc[0])
+        # the value sits in the cell right after its label
+        for table in tables[:count]:
+            for label in self._label_cells(table):
+                value = label.getnext()
+                if value is not None:
+                    column = self._labels[' '.join(''.join(label.itertext()).split()).lower()]
+                    data_dict[column] = ' '.join(''.join(value.itertext()).split())
 
-        return {column: data_dict.get(column.title(), "N/A") for column in self.columns}
+        return data_dict
 
     def get_first_empty_index(self, df):
         """
@@ -137,50 +200,133 @@ class Scraper:
             Returns:
                 int: The index of the first empty value, or the length of the DataFrame if none is found.
         """
-        if ~df.columns.isin(["STATUS"]).any():
-            index = 0
-        else:
-            try:
-                index = df.index[(df["STATUS"].isnull() | (df["STATUS"].astype(str).apply(len) == 0))].tolist()[0]
-            except IndexError:
-                index = len(df)  # Return the length of the DataFrame if no empty index is found
-        return index
+        if 'STATUS' not in df.columns:
+            return 0
+        status = df['STATUS']
+        mask = (status.isna() | (status == '')).to_numpy(dtype=bool)
+        # argmax stops at the first True; an all-False mask means every row is filled
+        return int(mask.argmax()) if mask.any() else len(df)
 
-    async def write_record(self, session, index, df):
-        id_value = df.at[index, 'N-NUMBER']
+    async def write_record(self, session, indices, id_value):
         data_dict = await self.process_record(session, id_value)
-        for column, value in data_dict.items():
-            df.at[index, column] = value
+        return indices, data_dict
+
+    def merge_records(self):
+        """
+            Apply the records checkpointed in the part file to the full input file,
+            write the result to the output file and remove the part file.
+        """
+        # keep_default_na=False so placeholders such as "N/A" are written back unchanged
+        df = pd.read_csv(self.input_file, dtype='string', keep_default_na=False)
+        columns = [*df.columns, *(column for column in self.columns if column not in df.columns)]
+        # plain dict updates instead of a DataFrame setitem per scraped cell
+        rows = df.to_dict('records')
+        with open(self.part_file, newline='') as part:
+            for record in csv.DictReader(part):
+                # a run killed mid-write can leave a cut-off last line behind
+                index = record.pop('INDEX')
+                if None in record.values() or not index.isdigit() or int(index) >= len(rows):
+                    self.logger.warning(f"Skipping incomplete checkpoint record: {index}")
+                    continue
+                rows[int(index)].update(record)
+        pd.DataFrame(rows, columns=columns).to_csv(self.output_file, index=False)
+        os.remove(self.part_file)
 
     async def gather_with_concurrency(self):
-        df = pd.read_csv(self.input_file, low_memory=False)
+        if os.path.exists(self.part_file):
+            # records left behind by a run that was killed before it could merge them
+            self.merge_records()
+        # only the id and the scraped columns are needed while scraping; keep_default_na=False so
+        # placeholders such as "N/A" are carried over unchanged rather than read as missing
+        df = pd.read_csv(self.input_file, usecols=lambda column: column == 'N-NUMBER' or column in self.columns,
+                         dtype='string', keep_default_na=False, engine='c')
         total_records = len(df)
         start_index = self.get_first_empty_index(df)
-        batch_size = 20
+        self.failed = []
 
-        self.logger.info(f"Total records: {total_records}, Starting index: {start_index}")
-        try:
-            async with aiohttp.ClientSession() as session:
-                for index in range(start_index, total_records, batch_size):
-                    end_index = min(index + batch_size, total_records)
-                    tasks = [self.write_record(session, index, df) for index in range(index, end_index)]
-                    await asyncio.gather(*tasks)
-                    self.logger.info(f"Processed records {index} to {end_index}.")
+        # N-NUMBERs that already have a STATUS are not fetched again
+        resolved = {}
+        done = pd.Series(False, index=df.index)
+        if 'STATUS' in df.columns:
+            done = df['STATUS'] != ''
+            done_df = df.loc[done].reindex(columns=self.columns).fillna('')
+            resolved = dict(zip(df.loc[done, 'N-NUMBER'], done_df.to_dict('records')))
+        # the rows still without a STATUS are grouped so every distinct N-NUMBER is requested once;
+        # finished rows are left alone so their values are never written back over themselves
+        pending = {}
+        unfinished = df.index[~done.to_numpy(dtype=bool)]
+        for index in unfinished[unfinished >= start_index]:
+            pending.setdefault(df.at[index, 'N-NUMBER'], []).append(int(index))
+        cached = [{'INDEX': index, **resolved[id_value]}
+                  for id_value in pending if id_value in resolved for index in pending[id_value]]
+        to_fetch = [id_value for id_value in pending if id_value not in resolved]
 
-                    df.to_csv(self.output_file, index=False)
+        self.logger.info(f"Total records: {total_records}, Starting index: {start_index}, "
+                         f"N-NUMBERs to fetch: {len(to_fetch)}, rows filled from earlier results: {len(cached)}")
+        # the registry is a single host, so keep one warm connection per concurrent request
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.concurrency, ttl_dns_cache=300,
+                                         keepalive_timeout=75, enable_cleanup_closed=True)
+        # the overall deadline leaves room for connecting on top of the read timeout
+        read_timeout = self.timeout or 20
+        timeout = aiohttp.ClientTimeout(total=max(30, read_timeout + 10), sock_connect=5, sock_read=read_timeout)
+        # a fixed set of workers pulls from one shared iterator, so a slow response only holds up
+        # its own worker and memory stays bounded by self.concurrency rather than the input size
+        id_values = iter(to_fetch)
+        results = asyncio.Queue()
+
+        async def worker():
+            try:
+                for id_value in id_values:
+                    await results.put(await self.write_record(session, pending[id_value], id_value))
+            except Exception as e:
+                await results.put(e)
+
+        try:
+            # rows are only appended while scraping; the full file is written once in merge_records
+            with open(self.part_file, 'w', newline='') as part:
+                writer = csv.DictWriter(part, fieldnames=['INDEX', *self.columns])
+                writer.writeheader()
+                writer.writerows(cached)
+                async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=DEFAULT_HEADERS) as session:
+                    workers = [asyncio.create_task(worker()) for _ in range(min(self.concurrency, len(to_fetch)))]
+                    # completed records are buffered and written out together at each checkpoint
+                    records = []
+                    try:
+                        for completed in range(1, len(to_fetch) + 1):
+                            result = await results.get()
+                            if isinstance(result, Exception):
+                                raise result
+                            indices, data_dict = result
+                            if data_dict:
+                                records.extend({'INDEX': index, **data_dict} for index in indices)
+                            if completed % self.concurrency == 0:
+                                self.logger.info(f"Processed {completed} of {len(to_fetch)} N-NUMBERs.")
+                                writer.writerows(records)
+                                records.clear()
+                                part.flush()
+                    finally:
+                        # only left running if the loop above was interrupted
+                        for task in workers:
+                            task.cancel()
+                        await asyncio.gather(*workers, return_exceptions=True)
+                        writer.writerows(records)
 
-                df.to_csv(self.output_file, index=False)
-                self.logger.info("Processing complete.")
+            self.logger.info("Processing complete.")
+            if self.failed:
+                self.logger.warning(f"{len(self.failed)} records could not be fetched: {', '.join(map(str, self.failed))}")
         except Exception as e:
             self.logger.info(f"Scraper was interrupted: {e} \nWrote extracted records into file.")
+        finally:
+            if os.path.exists(self.part_file):
+                self.merge_records()
 
     def run_scraper(self):
         self.logger.info("Starting the scraper...")
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(self.gather_with_concurrency())
+        run = uvloop.run if uvloop is not None else asyncio.run
+        run(self.gather_with_concurrency())
         self.logger.info("Scraper completed.")
 
 
 if __name__ == "__main__":
-    scraper = Scraper('data/ARMASTER11-21-23.csv', timeout=1)
+    scraper = Scraper('data/ARMASTER11-21-23.csv')
     scraper.run_scraper()